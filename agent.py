@@ -5,51 +5,111 @@ The core agent logic implemented with LangGraph.
 - Manages the conversation flow through different phases.
 - Streams responses and persists state at each step.
 """
+import datetime
+import functools
 import logging
-from typing import TypedDict, List, Tuple, Annotated, Dict, Any, Optional
+import re
+import sys
+from enum import IntEnum
+from typing import TypedDict, List, Tuple, Annotated, Callable, Dict, Any, Optional
 from bson.objectid import ObjectId
 
-from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
 from langgraph.graph import StateGraph, END
 
 from database import DatabaseManager
 from prompts import (
-    SYSTEM_PERSONA, VISION_AND_SCOPING_PROMPT, FUNCTIONAL_REQUIREMENTS_PROMPT,
-    DATA_MODEL_PROMPT, NFR_AND_SCALE_PROMPT, ARCHITECTURE_AND_COMPONENTS_PROMPT,
-    DEEP_DIVE_AND_TRADEOFFS_PROMPT, SUMMARY_PROMPT, ROUTER_PROMPT
+    SYSTEM_PERSONA, PHASE_PROMPTS, ROUTER_PROMPT_STATIC,
+    ROUTE_LABEL_TO_PHASE, render_router, render_summary,
+    PHASE_FOLLOW_UP_INSTRUCTION, HISTORY_SUMMARY_PROMPT
 )
 
-AGENT_PHASES = [
-    "vision_and_scoping",
-    "functional_requirements",
-    "data_model",
-    "nfr_and_scale",
-    "architecture_and_components",
-    "deep_dive_and_tradeoffs"
-]
-
-AGENT_PHASE_PROMPTS = {
-    "vision_and_scoping": VISION_AND_SCOPING_PROMPT,
-    "functional_requirements": FUNCTIONAL_REQUIREMENTS_PROMPT,
-    "data_model": DATA_MODEL_PROMPT,
-    "nfr_and_scale": NFR_AND_SCALE_PROMPT,
-    "architecture_and_components": ARCHITECTURE_AND_COMPONENTS_PROMPT,
-    "deep_dive_and_tradeoffs": DEEP_DIVE_AND_TRADEOFFS_PROMPT,
-}
+class Phase(IntEnum):
+    """Ordinal identifiers for the design phases and the terminal routes."""
+    VISION_AND_SCOPING = 0
+    FUNCTIONAL_REQUIREMENTS = 1
+    DATA_MODEL = 2
+    NFR_AND_SCALE = 3
+    ARCHITECTURE_AND_COMPONENTS = 4
+    DEEP_DIVE_AND_TRADEOFFS = 5
+    SUMMARIZE = 6
+    END = 7
+
+
+# Interned string labels derived from the enum: equality checks against router
+# output are pointer compares and [next]/[back] becomes index arithmetic.
+AGENT_PHASES = tuple(sys.intern(p.name.lower()) for p in Phase if p < Phase.SUMMARIZE)
+
+# Everything the LLM router is allowed to answer with, built once
+VALID_ROUTE_CHOICES = frozenset(AGENT_PHASES) | {sys.intern("summarize"), sys.intern("end")}
+
+# Explicit commands dominate real traffic and are fully deterministic, so they
+# are resolved from a precompiled regex plus a (phase, command) table without
+# ever touching the LLM router.
+_CMD_RE = re.compile(r"\[(next|back|summarize|end|exit)\]")
+
+
+def _build_transitions() -> Dict[Tuple[str, str], str]:
+    last = len(AGENT_PHASES) - 1
+    transitions = {}
+    for i, phase in enumerate(AGENT_PHASES):
+        transitions[(phase, "next")] = AGENT_PHASES[min(i + 1, last)]
+        transitions[(phase, "back")] = AGENT_PHASES[max(i - 1, 0)]
+        transitions[(phase, "summarize")] = "summarize"
+        transitions[(phase, "end")] = "end"
+        transitions[(phase, "exit")] = "end"
+    return transitions
+
+
+_TRANSITIONS = _build_transitions()
+
+# Second routing tier: unmistakable topic keywords resolved with substring
+# scans before falling back to the LLM router. First hit wins.
+_KEYWORD_ROUTES = (
+    ("user stor", "functional_requirements"),
+    ("user journey", "functional_requirements"),
+    ("endpoint", "functional_requirements"),
+    ("schema", "data_model"),
+    ("entities", "data_model"),
+    ("access pattern", "data_model"),
+    ("latency", "nfr_and_scale"),
+    ("availability", "nfr_and_scale"),
+    ("consistency", "nfr_and_scale"),
+    ("requests per second", "nfr_and_scale"),
+    ("load balancer", "architecture_and_components"),
+    ("message queue", "architecture_and_components"),
+    ("api gateway", "architecture_and_components"),
+    ("trade-off", "deep_dive_and_tradeoffs"),
+    ("tradeoff", "deep_dive_and_tradeoffs"),
+)
+
+# How many recent turns are sent to the LLM verbatim; older turns are folded
+# into a running summary so per-turn prefill cost stays bounded.
+HISTORY_WINDOW_TURNS = 20
+
+# Tag for LLM calls whose output is internal bookkeeping (e.g. the running
+# history summary); the stream filter drops token deltas carrying it.
+_INTERNAL_LLM_TAG = "internal"
 
 class AgentState(TypedDict):
     """Represents the state of our conversation graph."""
     discussion_id: str
     conversation_history: List[Tuple[str, str]]  # (speaker, text)
     current_phase: str
-    design_document: Dict[str, str]
+    design_document: Dict[str, List[str]]  # phase -> list of turn entries
     user_command: str
+    asked_guiding_question: Dict[str, bool]
+    route_decision: str  # where the router node sent this turn
+    history_summary: str  # running summary of turns outside the window
+    history_summary_turns: int  # how many leading turns the summary covers
 
 
 class SystemDesignAgent:
     """The main class for the System Design Co-Pilot agent."""
 
+    # How long the server-side persona cache stays alive before Gemini evicts it.
+    PERSONA_CACHE_TTL_MINUTES = 60
+
     def __init__(self, llm, db_manager: DatabaseManager):
         """
         Initializes the agent, its tools, and the LangGraph.
@@ -60,34 +120,132 @@ class SystemDesignAgent:
         """
         self.llm = llm
         self.db_manager = db_manager
+        self._cached_llm = self._create_persona_cache()
+        self._phase_cached_llms = self._create_phase_caches()
+        # The router's static instructions are one prebuilt system message; only
+        # the short rendered suffix changes between calls.
+        self._router_static_msg = SystemMessage(content=ROUTER_PROMPT_STATIC)
+        # The router answers with one letter, so cap its decode budget; a hard
+        # 1-token limit leaves no headroom for stray whitespace, hence 4.
+        self._router_llm = self._make_router_llm()
+        # Repeated free-text commands short-circuit to their previous decision
+        self._llm_route = functools.lru_cache(maxsize=256)(self._llm_route_uncached)
+        # The static message prefix per phase never changes within a process
+        self._static_phase_prefix = functools.lru_cache(maxsize=len(AGENT_PHASES))(
+            self._static_phase_prefix_uncached)
+        # Formatted LangChain messages per discussion, so each turn only
+        # constructs message objects for the new tail of the history.
+        self._fmt_cache: Dict[str, List[BaseMessage]] = {}
         self.graph = self._create_graph()
 
+    def _create_persona_cache(self):
+        """
+        Creates a Gemini server-side context cache holding SYSTEM_PERSONA and
+        returns a copy of the llm bound to it, so every phase-node call pays for
+        the persona prefill once per TTL instead of once per turn.
+
+        Returns None (callers fall back to inlining the persona) if the model or
+        environment does not support explicit context caching. Note that Gemini
+        enforces a minimum cacheable size (thousands of tokens, model-dependent)
+        that the persona alone sits well below, so on current models creation is
+        expected to fail here and the inline path is the one actually taken;
+        the attempt is kept for models with lower floors and larger prompt sets.
+        """
+        try:
+            from google.generativeai import caching
+
+            cache = caching.CachedContent.create(
+                model=getattr(self.llm, "model", None),
+                system_instruction=SYSTEM_PERSONA,
+                ttl=datetime.timedelta(minutes=self.PERSONA_CACHE_TTL_MINUTES),
+            )
+            logging.info(f"Created persona context cache: {cache.name}")
+            return self.llm.model_copy(update={"cached_content": cache.name})
+        except Exception as e:
+            logging.warning(f"Persona context caching unavailable, sending persona inline: {e}")
+            return None
+
+    def _create_phase_caches(self) -> Dict[str, Any]:
+        """
+        Creates one Gemini context cache per phase holding the persona plus
+        that phase's prompt, so turns within a phase start billing at the
+        conversation itself. Returns a phase -> bound-llm mapping; empty when
+        explicit caching is unsupported, in which case callers fall back to
+        the persona-only cache or fully inline prompts. Persona plus one phase
+        prompt is still below Gemini's minimum cacheable token count (see
+        _create_persona_cache), so the same expected-failure caveat applies.
+        """
+        caches: Dict[str, Any] = {}
+        try:
+            from google.generativeai import caching
+
+            for phase_name, phase_prompt in PHASE_PROMPTS.items():
+                cache = caching.CachedContent.create(
+                    model=getattr(self.llm, "model", None),
+                    system_instruction=SYSTEM_PERSONA,
+                    contents=[phase_prompt],
+                    ttl=datetime.timedelta(minutes=self.PERSONA_CACHE_TTL_MINUTES),
+                )
+                caches[phase_name] = self.llm.model_copy(update={"cached_content": cache.name})
+            logging.info(f"Created context caches for {len(caches)} phases.")
+        except Exception as e:
+            logging.warning(f"Per-phase context caching unavailable: {e}")
+            return {}
+        return caches
+
+    def _drop_context_caches(self):
+        """Forgets the server-side context caches, e.g. after a TTL expiry
+        surfaced as an invoke failure, so prompt prefixes go back to carrying
+        the persona and phase prompts inline."""
+        self._cached_llm = None
+        self._phase_cached_llms = {}
+        self._static_phase_prefix.cache_clear()
+
+    def _invoke_resilient(self, node_name: str,
+                          select_llm: Callable[[], Any],
+                          build_messages: Callable[[], List[BaseMessage]]) -> str:
+        """
+        Runs one node LLM call with a fallback for dead context caches.
+
+        The caches are created once with a fixed TTL and never refreshed, so a
+        long-lived process eventually holds handles to expired caches and every
+        call referencing them fails. When a cache-bound call errors, drop the
+        caches and retry once through the plain llm. The llm and messages come
+        from callables so both are rebuilt cache-free on the retry; only a
+        plain-llm failure propagates to the caller.
+        """
+        llm = select_llm()
+        try:
+            return llm.invoke(build_messages()).content
+        except Exception as e:
+            if llm is self.llm:
+                raise
+            logging.warning(
+                f"Context-cache call failed in {node_name}, retrying inline: {e}")
+            self._drop_context_caches()
+            return self.llm.invoke(build_messages()).content
+
     def _create_graph(self) -> StateGraph:
         """Builds the LangGraph state machine."""
         graph = StateGraph(AgentState)
 
-        # Add nodes for each phase
+        # The router runs exactly once per turn, records its decision in state,
+        # and dispatches to the chosen phase (or summary) node.
+        graph.add_node("router", self._router_node)
         for phase_name in AGENT_PHASES:
             graph.add_node(phase_name, self._create_phase_node(phase_name))
         graph.add_node("summarize", self._summary_node)
 
-        # Define the entry point
-        graph.set_entry_point(AGENT_PHASES[0])
-
-        # Add edges for the standard flow
+        graph.set_entry_point("router")
         graph.add_conditional_edges(
-            AGENT_PHASES[0],
-            self._router,
+            "router",
+            self._route_decision,
             {**{p: p for p in AGENT_PHASES}, "summarize": "summarize", "end": END}
         )
-        for i in range(1, len(AGENT_PHASES)):
-            graph.add_conditional_edges(
-                AGENT_PHASES[i],
-                self._router,
-                {**{p: p for p in AGENT_PHASES}, "summarize": "summarize", "end": END}
-            )
 
-        # The summary node can only end the conversation
+        # Each turn produces one response, then hands control back to the user
+        for phase_name in AGENT_PHASES:
+            graph.add_edge(phase_name, END)
         graph.add_edge("summarize", END)
         agent = graph.compile()
 
@@ -98,15 +256,26 @@ class SystemDesignAgent:
 
         return agent
 
-    def _format_history(self, history: List[Tuple[str, str]]) -> List[BaseMessage]:
-        """Formats the custom history tuple into LangChain messages."""
-        messages = []
-        for speaker, text in history:
-            if speaker == "user":
-                messages.append(HumanMessage(content=text))
-            else:
-                messages.append(AIMessage(content=text))
-        return messages
+    def _format_history(self, history: List[Tuple[str, str]],
+                        discussion_id: Optional[str] = None) -> List[BaseMessage]:
+        """
+        Formats the custom history tuple into LangChain messages.
+
+        With a discussion_id, previously formatted messages are reused and only
+        turns beyond the cached length are converted (the cache is truncated if
+        the history shrank, e.g. after a rollback). Callers must not mutate the
+        returned list in that case.
+        """
+        if discussion_id is None:
+            return [HumanMessage(content=text) if speaker == "user" else AIMessage(content=text)
+                    for speaker, text in history]
+
+        cached = self._fmt_cache.setdefault(discussion_id, [])
+        if len(cached) > len(history):
+            del cached[len(history):]
+        for speaker, text in history[len(cached):]:
+            cached.append(HumanMessage(content=text) if speaker == "user" else AIMessage(content=text))
+        return cached
 
     def _create_phase_node(self, phase_name: str):
         """A factory to create a node function for a given phase."""
@@ -114,73 +283,191 @@ class SystemDesignAgent:
         def phase_node(state: AgentState) -> Dict[str, Any]:
             self.db_manager.write_log(phase_name, {"discussion_id": state["discussion_id"]})
 
-            # Start of a new phase, so ask the guiding question
-            is_new_phase = state['conversation_history'][-1][0] == "user"
-
-            prompt_messages = [
-                HumanMessage(content=SYSTEM_PERSONA),
-                *self._format_history(state["conversation_history"])
-            ]
-            if is_new_phase:
-                prompt_messages.append(HumanMessage(content=AGENT_PHASE_PROMPTS[phase_name]))
+            asked = dict(state.get("asked_guiding_question") or {})
+
+            # Bound prefill cost: turns older than the window live in a running
+            # summary that is refreshed at most once per window of new turns.
+            history = state["conversation_history"]
+            summary = state.get("history_summary", "")
+            covered = state.get("history_summary_turns", 0) or 0
+            if len(history) - covered > 2 * HISTORY_WINDOW_TURNS:
+                summary, covered = self._refresh_history_summary(summary, history, covered)
+
+            # Static prefix first, dynamic conversation last, so provider
+            # prefix caches hit. With an active context cache the persona lives
+            # server-side and the request starts at the phase prompt. The llm
+            # and messages are built through callables so _invoke_resilient can
+            # redo both inline after dropping an expired context cache.
+            wants_follow_up = bool(asked.get(phase_name))
+            asked[phase_name] = True
+
+            def build_messages() -> List[BaseMessage]:
+                msgs: List[BaseMessage] = list(self._static_phase_prefix(phase_name))
+                if summary:
+                    msgs.append(SystemMessage(content=f"Summary of the earlier discussion: {summary}"))
+                msgs.extend(self._format_history(history, state["discussion_id"])[covered:])
+                if wants_follow_up:
+                    msgs.append(HumanMessage(content=PHASE_FOLLOW_UP_INSTRUCTION))
+                return msgs
 
             try:
-                response = self.llm.invoke(prompt_messages)
-                ai_message = response.content
+                ai_message = self._invoke_resilient(
+                    phase_name,
+                    lambda: self._phase_cached_llms.get(phase_name) or self._cached_llm or self.llm,
+                    build_messages,
+                )
             except Exception as e:
                 logging.error(f"LLM call failed in node {phase_name}: {e}")
                 ai_message = "I seem to be having trouble connecting. Could you try your message again?"
 
-            # Update state
-            updated_history = state["conversation_history"] + [("ai", ai_message)]
+            # Update state: the document holds a list of turn entries per phase,
+            # joined only at summary time, so each turn is an O(1) append rather
+            # than a rebuild of the whole phase text.
+            updated_history = history + [("ai", ai_message)]
             current_doc = state.get("design_document", {})
-            current_doc[phase_name] = current_doc.get(phase_name, "") + "\n" + "\n".join(
-                [msg[1] for msg in state["conversation_history"][-1:]]) + f"\nAI: {ai_message}"
+            last_user = history[-1][1] if history else ""
+            entries = current_doc.setdefault(phase_name, [])
+            if isinstance(entries, str):
+                # Discussions saved before the list-based document store one
+                # string per phase; wrap it so the append below keeps working.
+                entries = current_doc[phase_name] = [entries]
+            entries.append(f"User: {last_user}\nAI: {ai_message}")
 
             return {
                 "conversation_history": updated_history,
                 "design_document": current_doc,
+                "asked_guiding_question": asked,
+                "history_summary": summary,
+                "history_summary_turns": covered,
             }
 
         return phase_node
 
-    def _router(self, state: AgentState) -> str:
-        """Determines the next node to visit based on user command, using the router prompt for LLM-based routing if no explicit command is given."""
+    def _static_phase_prefix_uncached(self, phase_name: str) -> Tuple[SystemMessage, ...]:
+        """
+        The static leading messages for a phase node call: the persona always at
+        index 0 and the phase prompt at index 1, in that order, with no dynamic
+        text interleaved. Keeping the persona its own message means a phase
+        transition only invalidates the phase-prompt suffix of the cached
+        prefix, never the persona itself.
+
+        Wrapped in an lru_cache in __init__, so each phase's message tuple is
+        built once per process; callers must not mutate the returned messages.
+        """
+        if phase_name in self._phase_cached_llms:
+            # Persona and phase prompt both live in the server-side cache
+            return ()
+        if self._cached_llm is not None:
+            return (SystemMessage(content=PHASE_PROMPTS[phase_name]),)
+        return (
+            SystemMessage(content=SYSTEM_PERSONA),
+            SystemMessage(content=PHASE_PROMPTS[phase_name]),
+        )
+
+    def _refresh_history_summary(self, summary: str, history: List[Tuple[str, str]],
+                                 covered: int) -> Tuple[str, int]:
+        """
+        Folds turns older than the recency window into the running summary.
+
+        Returns the (possibly unchanged) summary and the number of leading
+        turns it now covers; on LLM failure the old values are kept so the
+        turns keep being sent verbatim.
+        """
+        cutoff = len(history) - HISTORY_WINDOW_TURNS
+        older = history[covered:cutoff]
+        if not older:
+            return summary, covered
+
+        older_text = "\n".join(f"{speaker}: {text}" for speaker, text in older)
+        try:
+            # Tagged as internal: this runs inside a phase node, so without the
+            # tag its tokens would stream to the UI as part of the reply.
+            response = self.llm.with_config(tags=[_INTERNAL_LLM_TAG]).invoke(
+                [HumanMessage(content=HISTORY_SUMMARY_PROMPT.format(
+                    existing_summary=summary or "(none yet)", older_turns=older_text))])
+            return response.content, cutoff
+        except Exception as e:
+            logging.error(f"History summarization failed, keeping verbatim turns: {e}")
+            return summary, covered
+
+    def _router_node(self, state: AgentState) -> Dict[str, Any]:
+        """Routes the turn once, logging the decision and updating the phase in state."""
         self.db_manager.write_log("router", {"command": state["user_command"]})
-        command = state["user_command"].lower().strip()
-        current_phase = state["current_phase"]
-
-        if "[next]" in command:
-            current_index = AGENT_PHASES.index(current_phase)
-            next_index = min(current_index + 1, len(AGENT_PHASES) - 1)
-            return AGENT_PHASES[next_index]
-        elif "[back]" in command:
-            current_index = AGENT_PHASES.index(current_phase)
-            next_index = max(current_index - 1, 0)
-            return AGENT_PHASES[next_index]
-        elif "[summarize]" in command:
-            return "summarize"
-        elif "[end]" in command or "[exit]" in command:
-            return "end"
+        destination = self._route(state["user_command"], state["current_phase"])
+        update: Dict[str, Any] = {"route_decision": destination}
+        if destination in AGENT_PHASES:
+            update["current_phase"] = destination
+        return update
+
+    def _route_decision(self, state: AgentState) -> str:
+        """Conditional-edge reader for the decision recorded by the router node."""
+        return state["route_decision"]
+
+    def _route(self, user_command: str, current_phase: str) -> str:
+        """Determines the next node to visit based on user command, using the router prompt for LLM-based routing if no explicit command is given."""
+        command = user_command.lower().strip()
+
+        match = _CMD_RE.search(command)
+        if match:
+            return _TRANSITIONS[(current_phase, match.group(1))]
+
+        for keyword, phase in _KEYWORD_ROUTES:
+            if keyword in command:
+                return phase
+
+        # Use LLM-based router prompt only when both cheap tiers miss. The
+        # cached wrapper only memoizes successful calls (failures raise), so a
+        # transient error never pins a (phase, command) pair to a bad answer.
+        try:
+            return self._llm_route(current_phase, command)
+        except Exception as e:
+            logging.error(f"LLM router failed, staying in {current_phase}: {e}")
+            return current_phase
+
+    def _make_router_llm(self):
+        """Returns a copy of the llm tuned for routing: deterministic and with
+        a bounded output budget. A valid answer is a single letter, but on the
+        2.5 models thinking tokens count toward max_output_tokens and thinking
+        cannot be fully disabled (the floor is 128 tokens), so the cap has to
+        sit comfortably above the minimum thinking budget or the model returns
+        empty content with finish_reason MAX_TOKENS. Falls back to the
+        unmodified llm if the model doesn't take these fields."""
+        try:
+            return self.llm.model_copy(update={
+                "temperature": 0.0,
+                "thinking_budget": 128,
+                "max_output_tokens": 256,
+            })
+        except Exception as e:
+            logging.warning(f"Could not build capped router llm, using default: {e}")
+            return self.llm
+
+    def _llm_route_uncached(self, current_phase: str, command: str) -> str:
+        """The LLM fallback of _route; wrapped in an lru_cache in __init__.
+
+        Raises on any failure (transport error, empty or unrecognized output)
+        rather than defaulting to current_phase, so only genuine routing
+        decisions end up memoized; _route handles the fallback uncached.
+        """
+        response = self._router_llm.invoke([
+            self._router_static_msg,
+            HumanMessage(content=render_router(current_phase, command)),
+        ])
+        raw = response.content.strip()
+        if not raw:
+            # An exhausted output cap (thinking ate the budget) surfaces as
+            # empty content rather than an exception; don't mistake it for a
+            # routing decision.
+            raise ValueError("router returned empty content")
+        if len(raw) == 1:
+            next_node = ROUTE_LABEL_TO_PHASE.get(raw.upper())
         else:
-            # Use LLM-based router prompt if no explicit command is given
-            try:
-                prompt = ChatPromptTemplate.from_template(ROUTER_PROMPT)
-                chain = prompt | self.llm
-                response = chain.invoke({
-                    "current_phase": current_phase,
-                    "user_command": state["user_command"]
-                })
-                next_node = response.content.strip().lower()
-                # Validate the LLM output
-                valid_choices = set(AGENT_PHASES + ["summarize", "end"])
-                if next_node in valid_choices:
-                    return next_node
-                else:
-                    return current_phase
-            except Exception as e:
-                logging.error(f"LLM router failed: {e}")
-                return current_phase
+            # The model ignored the letter format and answered with a full
+            # phase name; accept it if it's one of the valid choices.
+            next_node = sys.intern(raw.lower())
+        if next_node in VALID_ROUTE_CHOICES:
+            return next_node
+        raise ValueError(f"router returned unrecognized choice {raw!r}")
 
     def _summary_node(self, state: AgentState) -> Dict[str, Any]:
         """Generates and presents a summary of the design document."""
@@ -189,13 +476,23 @@ class SystemDesignAgent:
         full_document_text = ""
         for phase in AGENT_PHASES:
             if phase in state["design_document"]:
-                full_document_text += f"--- {phase.replace('_', ' ').title()} ---\n{state['design_document'][phase]}\n\n"
+                entries = state["design_document"][phase]
+                # Discussions saved before the list-based document keep working
+                phase_text = "\n".join(entries) if isinstance(entries, list) else entries
+                full_document_text += f"--- {phase.replace('_', ' ').title()} ---\n{phase_text}\n\n"
+
+        def build_messages() -> List[BaseMessage]:
+            msgs: List[BaseMessage] = [HumanMessage(content=render_summary(full_document_text))]
+            if self._cached_llm is None:
+                msgs.insert(0, SystemMessage(content=SYSTEM_PERSONA))
+            return msgs
 
         try:
-            prompt = ChatPromptTemplate.from_template(SUMMARY_PROMPT)
-            chain = prompt | self.llm
-            response = chain.invoke({"design_document": full_document_text})
-            summary_message = response.content
+            # One request carries everything the summary needs: persona (from
+            # the context cache when available, inlined otherwise) plus the
+            # rendered document.
+            summary_message = self._invoke_resilient(
+                "summarize", lambda: self._cached_llm or self.llm, build_messages)
         except Exception as e:
             logging.error(f"LLM call failed in summary node: {e}")
             summary_message = f"I encountered an error while generating the summary. Here is the raw data:\n\n{full_document_text}"
@@ -211,7 +508,8 @@ class SystemDesignAgent:
             discussion_id (Optional[str]): The ID of an existing discussion to resume.
 
         Yields:
-            Dict[str, Any]: Chunks of the streaming response from the graph.
+            Dict[str, Any]: Token deltas as {"delta": str} while the model is
+            generating, followed by the usual state-update chunks per graph step.
         """
         try:
             # Step 1: Load or initialize state
@@ -227,27 +525,55 @@ class SystemDesignAgent:
                     "conversation_history": [],
                     "current_phase": AGENT_PHASES[0],
                     "design_document": {},
-                    "user_command": ""
+                    "user_command": "",
+                    "asked_guiding_question": {},
+                    "route_decision": "",
+                    "history_summary": "",
+                    "history_summary_turns": 0
                 }
 
             # Step 2: Update state with new user input
             current_state["user_command"] = user_input
             current_state["conversation_history"].append(("user", user_input))
+            self.db_manager.append_history(current_state["discussion_id"], ("user", user_input))
 
-            # Step 3: Stream the graph execution
-            for chunk in self.graph.stream(current_state):
-                # Yield the chunk for the UI to process
-                yield chunk
-
-                # After each step, persist the latest complete state
-                latest_step_output = list(chunk.values())[0]
-                current_state.update(latest_step_output)
-
-                # Determine the *next* phase from the router for the state
-                next_phase = self._router(current_state)
-                if next_phase != 'end':
-                    current_state["current_phase"] = next_phase
-
+            # Step 3: Stream the graph execution, persisting only the new turns
+            # per step and the full state once at the end. "messages" mode
+            # surfaces individual tokens so the UI can render incrementally
+            # instead of waiting for the full completion.
+            try:
+                for mode, chunk in self.graph.stream(current_state, stream_mode=["updates", "messages"]):
+                    if mode == "messages":
+                        message_chunk, metadata = chunk
+                        # Only forward tokens from the user-facing nodes, not
+                        # internal calls like the LLM router or the tagged
+                        # history-summary refresh inside the phase nodes.
+                        if (metadata.get("langgraph_node") in (*AGENT_PHASES, "summarize")
+                                and _INTERNAL_LLM_TAG not in (metadata.get("tags") or ())):
+                            content = getattr(message_chunk, "content", "")
+                            if content:
+                                yield {"delta": content}
+                        continue
+
+                    # Yield the chunk for the UI to process
+                    yield chunk
+
+                    latest_step_output = next(iter(chunk.values()))
+
+                    # Persist just the turns this step added, not the whole state
+                    new_history = latest_step_output.get("conversation_history")
+                    if new_history:
+                        for entry in new_history[len(current_state["conversation_history"]):]:
+                            self.db_manager.append_history(
+                                current_state["discussion_id"], entry,
+                                current_state["current_phase"]
+                            )
+
+                    # The router node already wrote current_phase into its
+                    # update, so no second routing pass is needed here.
+                    current_state.update(latest_step_output)
+            finally:
+                # One full upsert so design_document and friends are durable
                 self.db_manager.save_discussion(current_state)
 
         except Exception as e:
@@ -11,7 +11,10 @@ The main Flet GUI application for the System Design Co-Pilot.
 import flet as ft
 import os
 import threading
+import time
 from dotenv import load_dotenv
+from langchain.globals import set_llm_cache
+from langchain_community.cache import SQLiteCache
 from langchain_google_genai import ChatGoogleGenerativeAI
 from agent import SystemDesignAgent, AGENT_PHASES
 from database import DatabaseManager
@@ -25,6 +28,9 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 MONGO_URI = os.getenv("MONGO_URI")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME")
 GEMINI_MODEL="gemini-2.5-pro"
+LLM_CACHE_PATH = ".llm_cache.db"
+# Minimum time between page updates while streaming (~60 Hz).
+UI_UPDATE_MIN_INTERVAL = 0.016
 
 # --- UI Styling Constants ---
 GLASS_EFFECT = {
@@ -64,6 +70,7 @@ class ChatApp:
         self.agent = agent
         self.db_manager = db_manager
         self.current_discussion_id = None
+        self._last_ui_update = 0.0
 
         self._setup_page()
         self._build_layout()
@@ -160,6 +167,14 @@ class ChatApp:
         # Start agent processing in a separate thread
         threading.Thread(target=self.run_agent_thread, args=(user_text,)).start()
 
+    def _throttled_update(self):
+        """Coalesces page updates so token streaming doesn't flood the socket
+        with control-tree diffs; at most one update per UI_UPDATE_MIN_INTERVAL."""
+        now = time.monotonic()
+        if now - self._last_ui_update >= UI_UPDATE_MIN_INTERVAL:
+            self.page.update()
+            self._last_ui_update = now
+
     def run_agent_thread(self, user_text: str):
         """The background thread that runs the agent and updates the UI."""
         ai_message_control = Message("", "ai")
@@ -172,9 +187,16 @@ class ChatApp:
                     self.show_error(chunk["error"])
                     break
 
+                # Token deltas arrive while the model is still generating
+                if "delta" in chunk:
+                    full_response += chunk["delta"]
+                    ai_message_control.value = full_response
+                    self._throttled_update()
+                    continue
+
                 # The first chunk contains the full new state, not message content
-                if list(chunk.keys())[0] in AGENT_PHASES + ["summarize"]:
-                    latest_step = list(chunk.values())[0]
+                if next(iter(chunk)) in (*AGENT_PHASES, "summarize"):
+                    latest_step = next(iter(chunk.values()))
                     # Update current discussion ID if it's a new chat
                     if not self.current_discussion_id:
                         self.current_discussion_id = latest_step.get("discussion_id")
@@ -186,16 +208,16 @@ class ChatApp:
                     # Update the AI message control
                     full_response = new_content
                     ai_message_control.value = full_response
-                    self.page.update()
+                    self._throttled_update()
 
         except Exception as ex:
             logging.error(f"A critical error occurred in the agent thread: {ex}", exc_info=True)
             self.show_error(f"A critical error occurred: {ex}")
         finally:
-            # Re-enable input fields on the main thread
+            # Re-enable input fields and flush any throttled content
             self.user_input.disabled = False
             self.send_button.disabled = False
-            self.page.update()
+            self.page.update()  # unconditional: the last throttled delta must land
 
     def show_error(self, message: str):
         """Displays a non-blocking SnackBar with an error message."""
@@ -231,7 +253,12 @@ class ChatApp:
         self.chat_view.controls.append(Message(f"Loading discussion: {selected_id[:8]}...", "ai"))
         self.page.update()
 
-        discussion_state = self.db_manager.load_discussion(selected_id)
+        # The chat view only renders the conversation; skip fetching the
+        # potentially large design_document.
+        discussion_state = self.db_manager.load_discussion(
+            selected_id,
+            projection={"conversation_history": 1, "current_phase": 1}
+        )
 
         self.chat_view.controls.clear()
         if discussion_state and "conversation_history" in discussion_state:
@@ -257,6 +284,10 @@ def main(page: ft.Page):
         return
 
     try:
+        # Identical prompts (dev reruns, [back] navigation) short-circuit to a
+        # local cache instead of paying another API round-trip.
+        set_llm_cache(SQLiteCache(database_path=LLM_CACHE_PATH))
+
         db_manager = DatabaseManager(uri=MONGO_URI, db_name=MONGO_DB_NAME)
         llm = ChatGoogleGenerativeAI(model=GEMINI_MODEL, google_api_key=GOOGLE_API_KEY, temperature=0.7)
         agent = SystemDesignAgent(llm=llm, db_manager=db_manager)
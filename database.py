@@ -5,10 +5,16 @@ Handles all database interactions with MongoDB.
 - Provides CRUD operations for discussions and logs.
 - Implements robust error handling for all database operations.
 """
+import hashlib
 import logging
+import queue
+import threading
 from typing import Dict, Any, Optional, List, Tuple
 import time
+import bson
 import pymongo
+from bson.binary import UuidRepresentation
+from bson.codec_options import CodecOptions
 from bson.objectid import ObjectId
 from pymongo.errors import ConnectionFailure, OperationFailure
 from pymongo.mongo_client import MongoClient
@@ -17,6 +23,24 @@ from pymongo.server_api import ServerApi
 # Set up basic logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Cap on how many past discussions the history sidebar fetches.
+MAX_SIDEBAR_DISCUSSIONS = 50
+
+# How many characters of the first user message become the sidebar title.
+TITLE_MAX_CHARS = 50
+
+# Log entries are flushed when a batch fills up or this interval elapses.
+LOG_FLUSH_BATCH_SIZE = 50
+LOG_FLUSH_INTERVAL_SECONDS = 0.5
+
+
+def _derive_title(history: List[Tuple[str, str]]) -> Optional[str]:
+    """Builds a sidebar title from the first user message, if there is one."""
+    first_user_msg = next((msg for msg in history if msg[0] == "user"), None)
+    if first_user_msg:
+        return first_user_msg[1][:TITLE_MAX_CHARS] + "..."
+    return None
+
 
 class DatabaseManager:
     """A robust manager for MongoDB interactions."""
@@ -32,12 +56,40 @@ class DatabaseManager:
         self.client = None
         self.db = None
         try:
-            self.client = MongoClient(uri, server_api=ServerApi('1'))
+            # Explicit pool sizing: the agent thread fires log/history writes on
+            # every graph step, so keep a couple of warm connections around and
+            # bound the pool instead of relying on driver defaults. Compressors
+            # are negotiated with the server and skipped if unavailable.
+            self.client = MongoClient(
+                uri,
+                server_api=ServerApi('1'),
+                maxPoolSize=20,
+                minPoolSize=2,
+                maxIdleTimeMS=60_000,
+                compressors='zstd,snappy',
+                retryWrites=True
+            )
             # Send a ping to confirm a successful connection
             self.client.admin.command('ping')
-            self.db = self.client[db_name]
+            # Plain dicts, no tz conversion: keeps BSON encode/decode of the
+            # large state documents on the fastest (C extension) path.
+            self.db = self.client.get_database(
+                db_name,
+                codec_options=CodecOptions(
+                    document_class=dict,
+                    tz_aware=False,
+                    uuid_representation=UuidRepresentation.STANDARD
+                )
+            )
             logging.info("Successfully connected to MongoDB.")
             self._setup_collections()
+            # Logs are observability, not state: queue them and let a daemon
+            # thread batch-insert so callers never block on a Mongo round-trip.
+            self._log_queue: queue.Queue = queue.Queue()
+            threading.Thread(target=self._log_flusher, daemon=True).start()
+            # Content hash of the last state persisted per discussion, used to
+            # skip upserts that would write identical data.
+            self._last_saved_hash: Dict[str, str] = {}
         except ConnectionFailure as e:
             logging.error(f"Could not connect to MongoDB: {e}")
             raise
@@ -54,53 +106,94 @@ class DatabaseManager:
             if "logs" not in self.db.list_collection_names():
                 self.db.create_collection("logs")
                 logging.info("Created 'logs' collection.")
+            # Index-backed sorts keep the sidebar query off a full collection
+            # scan; create_index is a no-op if the index already exists.
+            self.db.discussions.create_index([("timestamp", pymongo.DESCENDING)])
+            self.db.logs.create_index([("timestamp", pymongo.DESCENDING), ("node", pymongo.ASCENDING)])
         except OperationFailure as e:
             logging.error(f"Failed to create collections: {e}")
             raise
 
     def write_log(self, node: str, data: Dict[str, Any]) -> bool:
         """
-        Writes a log entry to the 'logs' collection.
+        Queues a log entry for the 'logs' collection.
+
+        The entry is written asynchronously by the background flusher, so this
+        never blocks the caller on a database round-trip.
 
         Args:
             node (str): The name of the graph node being executed.
             data (Dict[str, Any]): The data to log.
 
         Returns:
-            bool: True if write was successful, False otherwise.
+            bool: True if the entry was queued, False otherwise.
         """
         if self.db is None:
             logging.error("Database not connected. Cannot write log.")
             return False
-        try:
-            log_entry = {"node": node, "data": data, "timestamp": int(time.time())}
-            self.db.logs.insert_one(log_entry)
-            return True
-        except OperationFailure as e:
-            logging.error(f"Failed to write log to MongoDB: {e}")
-            return False
+        self._log_queue.put_nowait({"node": node, "data": data, "timestamp": int(time.time())})
+        return True
+
+    def _log_flusher(self):
+        """Drains the log queue forever, bulk-inserting batches of entries."""
+        while True:
+            batch = [self._log_queue.get()]
+            deadline = time.monotonic() + LOG_FLUSH_INTERVAL_SECONDS
+            while len(batch) < LOG_FLUSH_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._log_queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self.db.logs.insert_many(batch, ordered=False)
+            except OperationFailure as e:
+                logging.error(f"Failed to flush {len(batch)} log entries to MongoDB: {e}")
+            except Exception as e:
+                logging.error(f"An unexpected error occurred while flushing logs: {e}")
 
     def save_discussion(self, state: Dict[str, Any]) -> bool:
         """
         Saves or updates a discussion state in the 'discussions' collection.
+        Writes whose content is identical to the last persisted state for the
+        same discussion are skipped.
 
         Args:
             state (Dict[str, Any]): The agent's state dictionary.
 
         Returns:
-            bool: True if save was successful, False otherwise.
+            bool: True if save was successful (or skipped as a no-op), False otherwise.
         """
         if self.db is None:
             logging.error("Database not connected. Cannot save discussion.")
             return False
         try:
+            state_hash = hashlib.sha256(bson.encode(state)).hexdigest()
+            if self._last_saved_hash.get(state["discussion_id"]) == state_hash:
+                return True
+
             discussion_id = ObjectId(state["discussion_id"])
-            # Use upsert to create the document if it doesn't exist
+            # Use upsert to create the document if it doesn't exist; stamp the
+            # sort key on every save so the sidebar orders by last activity.
+            now = int(time.time())
+            on_insert: Dict[str, Any] = {"created_at": now}
+            title = _derive_title(state.get("conversation_history", []))
+            if title:
+                on_insert["title"] = title
+            # States resumed via load_discussion carry the bookkeeping fields
+            # (title, created_at, timestamp); they must not appear in $set as
+            # well, since Mongo rejects an update where two operators target
+            # the same path.
+            doc = {k: v for k, v in state.items()
+                   if k not in ("title", "created_at", "timestamp")}
             self.db.discussions.update_one(
                 {"_id": discussion_id},
-                {"$set": state},
+                {"$set": {**doc, "timestamp": now}, "$setOnInsert": on_insert},
                 upsert=True
             )
+            self._last_saved_hash[state["discussion_id"]] = state_hash
             return True
         except OperationFailure as e:
             logging.error(f"Failed to save discussion {state.get('discussion_id')}: {e}")
@@ -109,12 +202,58 @@ class DatabaseManager:
             logging.error(f"An unexpected error occurred while saving discussion: {e}")
             return False
 
-    def load_discussion(self, discussion_id: str) -> Optional[Dict[str, Any]]:
+    def append_history(self, discussion_id: str, entry: Tuple[str, str],
+                       current_phase: Optional[str] = None) -> bool:
+        """
+        Appends a single (speaker, text) turn to a discussion's history.
+
+        This is the incremental alternative to save_discussion: the write
+        payload is one turn instead of the whole state document.
+
+        Args:
+            discussion_id (str): The unique ID of the discussion.
+            entry (Tuple[str, str]): The (speaker, text) turn to append.
+            current_phase (Optional[str]): If given, also updates the phase.
+
+        Returns:
+            bool: True if the write was successful, False otherwise.
+        """
+        if self.db is None:
+            logging.error("Database not connected. Cannot append history.")
+            return False
+        try:
+            update: Dict[str, Any] = {
+                "$push": {"conversation_history": list(entry)},
+                "$set": {"timestamp": int(time.time())}
+            }
+            if current_phase:
+                update["$set"]["current_phase"] = current_phase
+            if entry[0] == "user":
+                # A brand-new discussion is created by its first user turn, so
+                # denormalize the sidebar title here, once.
+                update["$setOnInsert"] = {"title": entry[1][:TITLE_MAX_CHARS] + "..."}
+            self.db.discussions.update_one(
+                {"_id": ObjectId(discussion_id)},
+                update,
+                upsert=True
+            )
+            return True
+        except OperationFailure as e:
+            logging.error(f"Failed to append history to discussion {discussion_id}: {e}")
+            return False
+        except Exception as e:
+            logging.error(f"An unexpected error occurred while appending history: {e}")
+            return False
+
+    def load_discussion(self, discussion_id: str,
+                        projection: Optional[Dict[str, int]] = None) -> Optional[Dict[str, Any]]:
         """
         Loads a discussion state from the database.
 
         Args:
             discussion_id (str): The unique ID of the discussion.
+            projection (Optional[Dict[str, int]]): A MongoDB projection limiting
+                which fields are fetched. None loads the full state.
 
         Returns:
             Optional[Dict[str, Any]]: The state dictionary or None if not found or on error.
@@ -124,7 +263,7 @@ class DatabaseManager:
             return None
         try:
             obj_id = ObjectId(discussion_id)
-            state = self.db.discussions.find_one({"_id": obj_id})
+            state = self.db.discussions.find_one({"_id": obj_id}, projection)
             if state and '_id' in state:
                 state['discussion_id'] = str(state['_id'])
                 del state['_id']  # Clean up the mongo-specific key
@@ -138,8 +277,9 @@ class DatabaseManager:
 
     def get_all_discussions(self) -> Optional[List[Tuple[str, str]]]:
         """
-        Retrieves a list of all past discussions for the history view.
-        Returns only the ID and a title derived from the first user message.
+        Retrieves a list of recent discussions for the history view.
+        Returns only the ID and the denormalized title, so no conversation
+        content crosses the wire.
 
         Returns:
             Optional[List[Tuple[str, str]]]: A list of (id, title) tuples, or None on error.
@@ -148,22 +288,12 @@ class DatabaseManager:
             logging.error("Database not connected. Cannot get discussions.")
             return None
         try:
-            discussions = []
             cursor = self.db.discussions.find(
                 {},
-                {"_id": 1, "conversation_history": 1}
-            ).sort("timestamp", pymongo.DESCENDING)  # Assuming you add a timestamp
-
-            for doc in cursor:
-                doc_id = str(doc['_id'])
-                # Find the first user message for a title
-                title = "New Discussion"
-                if doc.get("conversation_history"):
-                    first_user_msg = next((msg for msg in doc["conversation_history"] if msg[0] == "user"), None)
-                    if first_user_msg:
-                        title = first_user_msg[1][:50] + "..."  # Truncate for display
-                discussions.append((doc_id, title))
-            return discussions
+                {"_id": 1, "title": 1}
+            ).sort("timestamp", pymongo.DESCENDING).limit(MAX_SIDEBAR_DISCUSSIONS)
+
+            return [(str(doc['_id']), doc.get("title", "New Discussion")) for doc in cursor]
         except OperationFailure as e:
             logging.error(f"Failed to retrieve all discussions: {e}")
             return None
@@ -2,8 +2,22 @@
 """
 Contains all prompt templates for the System Design Co-Pilot agent.
 """
+import functools
+import json
+import os
+import re
+import sys
+from types import MappingProxyType, SimpleNamespace
+from typing import Callable, Dict, Final
 
-SYSTEM_PERSONA = (
+
+def _pack(s: str) -> str:
+    """Collapses trailing whitespace and runs of blank lines. The prompts are
+    sent on every LLM call, so each stray whitespace token is paid repeatedly;
+    this is a pure token-count reduction with no semantic change."""
+    return re.sub(r"\n{3,}", "\n\n", re.sub(r"[ \t]+\n", "\n", s)).strip()
+
+SYSTEM_PERSONA: Final[str] = sys.intern(_pack(
     "You are an expert Staff-level Software Engineer and AI Architect acting as a Socratic system design coach. "
     "Your goal is to guide the user from a high-level idea to a well-defined set of system requirements. "
     "You MUST NOT provide direct answers or solutions. Instead, you MUST ask probing, open-ended questions "
@@ -11,75 +25,291 @@ SYSTEM_PERSONA = (
     "Your tone is professional, encouraging, and collaborative. "
     "You will guide the user through a series of phases. In each phase, ask the specified questions. "
     "Base your follow-up questions on the user's responses to dig deeper."
-)
+))
 
-ROUTER_PROMPT = (
+# The router answers with one of these single letters instead of a snake_case
+# phase name, so the decode side of every router call is one token. Keep the
+# letters in sync with the enumeration inside ROUTER_PROMPT_STATIC.
+ROUTE_LABEL_TO_PHASE = MappingProxyType({
+    "A": sys.intern("vision_and_scoping"),
+    "F": sys.intern("functional_requirements"),
+    "D": sys.intern("data_model"),
+    "N": sys.intern("nfr_and_scale"),
+    "C": sys.intern("architecture_and_components"),
+    "T": sys.intern("deep_dive_and_tradeoffs"),
+    "S": sys.intern("summarize"),
+    "E": sys.intern("end"),
+})
+
+# The router prompt is split so the instruction block stays a byte-identical
+# prefix across calls (provider prompt caches key on the prefix) and only the
+# short per-turn block below varies.
+ROUTER_PROMPT_STATIC: Final[str] = sys.intern(_pack(
     "You are an expert at routing user requests in a system design discussion. "
     "Based on the user's last message, determine the next step. "
     "The user can use commands like [next], [back], [summarize], or [end]. "
     "If no explicit command is given, the user is likely still discussing the current topic. "
-    "Your available choices are: 'vision_and_scoping', 'functional_requirements', "
-    "'data_model', 'nfr_and_scale', 'architecture_and_components', 'deep_dive_and_tradeoffs', 'summarize', or 'end'.\n\n"
+    "Your available choices are:\n"
+    "A = vision_and_scoping\n"
+    "F = functional_requirements\n"
+    "D = data_model\n"
+    "N = nfr_and_scale\n"
+    "C = architecture_and_components\n"
+    "T = deep_dive_and_tradeoffs\n"
+    "S = summarize\n"
+    "E = end\n\n"
+    "Respond with ONLY the single letter of the next appropriate choice, and nothing else. "
+    "For example, if the user says '[next]', and the current phase is 'vision_and_scoping', you should respond with 'F'."
+))
+
+ROUTER_PROMPT_DYNAMIC: Final[str] = (
     "Current Phase: {current_phase}\n"
-    "User's last message: '{user_command}'\n\n"
-    "Respond with ONLY the name of the next appropriate choice. For example, if the user says '[next]', and the current phase is 'vision_and_scoping', you should respond with 'functional_requirements'."
+    "User's last message: '{user_command}'"
+)
+
+HISTORY_SUMMARY_PROMPT: Final[str] = _pack(
+    "You maintain a running summary of an ongoing system design discussion. "
+    "Fold the older conversation turns below into the existing summary, keeping every "
+    "decision, requirement, and open question, and staying as concise as possible.\n\n"
+    "Existing summary:\n{existing_summary}\n\n"
+    "Older turns to fold in:\n{older_turns}\n\n"
+    "Respond with ONLY the updated summary."
 )
 
+PHASE_FOLLOW_UP_INSTRUCTION: Final[str] = sys.intern(_pack(
+    "You have already asked this phase's guiding questions. Do not repeat them. "
+    "Respond to the user's latest message with deeper follow-up questions instead."
+))
+
 # --- Phase-specific Prompts ---
+#
+# The verbose prose prompts are the documented source of the phase agendas but
+# are only needed when COMPACT_PHASE_PROMPTS=0 (or when a tool inspects them),
+# so they are materialized lazily via the module __getattr__ below (PEP 562)
+# instead of being allocated on every import.
 
-VISION_AND_SCOPING_PROMPT = (
-    "Let's begin with the big picture. To build a solid foundation, we need to understand the 'why' behind this project.\n\n"
-    "First, what is the core problem you're aiming to solve? Who are your primary users, and what are their biggest pain points that this system will address?\n\n"
-    "Next, what are the absolute, must-have outcomes for a version 1? Think about the minimum viable product (MVP) that delivers real value.\n\n"
-    "Finally, let's talk about constraints. Are there any hard limits on budget, timeline, team expertise, or required use of existing company infrastructure?"
-)
+# Shared bullet scaffolding for the list-style prompts below; the joins run
+# once per materialization and the items stay easy to edit individually.
+_TOPIC_BULLET = "- **{0}:** {1}"
+_COMPONENT_BULLET = "- **{0}** ({1})"
 
-FUNCTIONAL_REQUIREMENTS_PROMPT = (
-    "Great, we have a clear vision. Now, let's detail *what* the system will do. Let's define the functional requirements.\n\n"
-    "Could you describe the key user journeys? For example, walk me through the steps a user would take to accomplish their main goal, from start to finish.\n\n"
-    "Can you list the core features as user stories? The format 'As a [user type], I can [perform an action] so that [I get this benefit]' is very helpful.\n\n"
-    "Will this system expose an API for other services or clients? If so, what are the crucial endpoints you envision, such as `POST /users` or `GET /products/{id}`?"
+_NFR_ITEMS = (
+    ("Latency", "What is an acceptable response time for your users? For example, should 95% of requests complete in under 200ms?"),
+    ("Availability", "How critical is uptime? Are you aiming for 'three nines' (99.9% uptime, ~8.7h downtime/year), 'four nines' (99.99%, ~52m downtime/year), or is less availability acceptable initially?"),
+    ("Consistency", "If data is written to the system, does it need to be readable by everyone instantly (strong consistency), or is a small delay acceptable (eventual consistency)?"),
 )
 
-DATA_MODEL_PROMPT = (
-    "Excellent. With the functionality defined, let's focus on the data—the lifeblood of the system.\n\n"
-    "What are the fundamental entities or 'nouns' in your system? Think about core concepts like 'User', 'Product', 'Order', 'Document', etc.\n\n"
-    "How do these entities relate to each other? Is it one-to-many (a User has many Orders), many-to-many (a Product can be in many Categories)?\n\n"
-    "What kind of data will you store for each entity? Is it highly structured like a user profile, semi-structured like a JSON document, or unstructured like a full blog post or image?\n\n"
-    "Crucially, let's consider the access patterns. Will your system be read-heavy (like a news site), write-heavy (like a logging service), or balanced?"
+_ARCH_CORE_ITEMS = (
+    ("Client-Facing Interface", "e.g., Web Server, API Gateway"),
+    ("Core Business Logic", "e.g., Application Server or Serverless Functions"),
+    ("Primary Data Store", "e.g., Database"),
 )
 
-NFR_AND_SCALE_PROMPT = (
-    "Now let's discuss the non-functional requirements (NFRs), which define the system's quality and scalability.\n\n"
-    "Let's do a 'back-of-the-envelope' scale estimation. How many daily active users and requests per second are you targeting at launch, and then in one year?\n\n"
-    "- **Latency:** What is an acceptable response time for your users? For example, should 95% of requests complete in under 200ms?\n"
-    "- **Availability:** How critical is uptime? Are you aiming for 'three nines' (99.9% uptime, ~8.7h downtime/year), 'four nines' (99.99%, ~52m downtime/year), or is less availability acceptable initially?\n"
-    "- **Consistency:** If data is written to the system, does it need to be readable by everyone instantly (strong consistency), or is a small delay acceptable (eventual consistency)?"
+_ARCH_SUPPORT_ITEMS = (
+    ("Traffic Management", "Load Balancers"),
+    ("Performance", "Caches"),
+    ("Asynchronous Communication", "Message Queues, Event Buses"),
+    ("User Identity", "Authentication/Authorization Service"),
+    ("Intensive Tasks", "Background Workers"),
 )
 
-ARCHITECTURE_AND_COMPONENTS_PROMPT = (
-    "With a clear picture of the requirements, let's start sketching a high-level architectural blueprint.\n\n"
-    "Let's think in terms of major building blocks. We will almost certainly need:\n"
-    "- A **Client-Facing Interface** (e.g., Web Server, API Gateway)\n"
-    "- The **Core Business Logic** (e.g., Application Server or Serverless Functions)\n"
-    "- A **Primary Data Store** (e.g., Database)\n\n"
-    "What other supporting services do you foresee? Consider components for:\n"
-    "- **Traffic Management** (Load Balancers)\n"
-    "- **Performance** (Caches)\n"
-    "- **Asynchronous Communication** (Message Queues, Event Buses)\n"
-    "- **User Identity** (Authentication/Authorization Service)\n"
-    "- **Intensive Tasks** (Background Workers)"
-)
+@functools.cache
+def _verbose_prompts() -> Dict[str, str]:
+    """Builds the verbose prose prompt bodies on first use."""
+    return {
+        "VISION_AND_SCOPING_PROMPT": (
+            "Let's begin with the big picture. To build a solid foundation, we need to understand the 'why' behind this project.\n\n"
+            "First, what is the core problem you're aiming to solve? Who are your primary users, and what are their biggest pain points that this system will address?\n\n"
+            "Next, what are the absolute, must-have outcomes for a version 1? Think about the minimum viable product (MVP) that delivers real value.\n\n"
+            "Finally, let's talk about constraints. Are there any hard limits on budget, timeline, team expertise, or required use of existing company infrastructure?"
+        ),
+        "FUNCTIONAL_REQUIREMENTS_PROMPT": (
+            "Great, we have a clear vision. Now, let's detail *what* the system will do. Let's define the functional requirements.\n\n"
+            "Could you describe the key user journeys? For example, walk me through the steps a user would take to accomplish their main goal, from start to finish.\n\n"
+            "Can you list the core features as user stories? The format 'As a [user type], I can [perform an action] so that [I get this benefit]' is very helpful.\n\n"
+            "Will this system expose an API for other services or clients? If so, what are the crucial endpoints you envision, such as `POST /users` or `GET /products/{id}`?"
+        ),
+        "DATA_MODEL_PROMPT": (
+            "Excellent. With the functionality defined, let's focus on the data—the lifeblood of the system.\n\n"
+            "What are the fundamental entities or 'nouns' in your system? Think about core concepts like 'User', 'Product', 'Order', 'Document', etc.\n\n"
+            "How do these entities relate to each other? Is it one-to-many (a User has many Orders), many-to-many (a Product can be in many Categories)?\n\n"
+            "What kind of data will you store for each entity? Is it highly structured like a user profile, semi-structured like a JSON document, or unstructured like a full blog post or image?\n\n"
+            "Crucially, let's consider the access patterns. Will your system be read-heavy (like a news site), write-heavy (like a logging service), or balanced?"
+        ),
+        "NFR_AND_SCALE_PROMPT": (
+            "Now let's discuss the non-functional requirements (NFRs), which define the system's quality and scalability.\n\n"
+            "Let's do a 'back-of-the-envelope' scale estimation. How many daily active users and requests per second are you targeting at launch, and then in one year?\n\n"
+            + "\n".join(_TOPIC_BULLET.format(title, question) for title, question in _NFR_ITEMS)
+        ),
+        "ARCHITECTURE_AND_COMPONENTS_PROMPT": (
+            "With a clear picture of the requirements, let's start sketching a high-level architectural blueprint.\n\n"
+            "Let's think in terms of major building blocks. We will almost certainly need:\n"
+            + "\n".join(_COMPONENT_BULLET.format(name, examples) for name, examples in _ARCH_CORE_ITEMS)
+            + "\n\nWhat other supporting services do you foresee? Consider components for:\n"
+            + "\n".join(_COMPONENT_BULLET.format(name, examples) for name, examples in _ARCH_SUPPORT_ITEMS)
+        ),
+        "DEEP_DIVE_AND_TRADEOFFS_PROMPT": (
+            "This architecture looks promising. The true mark of a great design is understanding its trade-offs. Let's challenge some of our assumptions.\n\n"
+            "Let's pick a key component we've discussed, like the database. If you were thinking of a relational SQL database, what are the pros and cons of that choice versus a NoSQL alternative (like a document, key-value, or graph store) for this specific use case?\n\n"
+            "Now consider how our services will communicate. What are the trade-offs between using synchronous APIs (like REST or gRPC) versus adopting an asynchronous, event-driven pattern for your system's core workflows? When would one be clearly better than the other?"
+        ),
+    }
 
-DEEP_DIVE_AND_TRADEOFFS_PROMPT = (
-    "This architecture looks promising. The true mark of a great design is understanding its trade-offs. Let's challenge some of our assumptions.\n\n"
-    "Let's pick a key component we've discussed, like the database. If you were thinking of a relational SQL database, what are the pros and cons of that choice versus a NoSQL alternative (like a document, key-value, or graph store) for this specific use case?\n\n"
-    "Now consider how our services will communicate. What are the trade-offs between using synchronous APIs (like REST or gRPC) versus adopting an asynchronous, event-driven pattern for your system's core workflows? When would one be clearly better than the other?"
-)
 
-SUMMARY_PROMPT = (
+_VERBOSE_PROMPT_NAMES = frozenset({
+    "VISION_AND_SCOPING_PROMPT", "FUNCTIONAL_REQUIREMENTS_PROMPT",
+    "DATA_MODEL_PROMPT", "NFR_AND_SCALE_PROMPT",
+    "ARCHITECTURE_AND_COMPONENTS_PROMPT", "DEEP_DIVE_AND_TRADEOFFS_PROMPT",
+})
+
+
+def __getattr__(name: str) -> str:
+    """PEP 562 hook: materialize a verbose prompt constant on first access and
+    cache it in the module globals so later accesses are plain lookups."""
+    if name in _VERBOSE_PROMPT_NAMES:
+        value = _verbose_prompts()[name]
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+SUMMARY_PROMPT: Final[str] = (
     "We've covered a lot of ground. I will now synthesize our entire discussion, from vision to trade-offs, into a consolidated system design document. "
     "Please review it and let me know if there are any gaps or misinterpretations.\n\n"
     "Here is the summary of your system design based on our conversation:\n\n"
     "{design_document}"
+)
+
+# --- Precompiled lookups and renderers ---
+
+# Each phase's Socratic agenda as a compact schema. Rendered through the terse
+# meta-prompt below, these elicit the same coaching behavior as the verbose
+# prose prompts at a fraction of the input-token cost.
+PHASE_SCHEMAS = MappingProxyType({
+    "vision_and_scoping": {"ask": [
+        "core_problem", "primary_users_and_pain_points", "mvp_outcomes",
+        "constraints_budget_timeline_team_infra"]},
+    "functional_requirements": {"ask": [
+        "key_user_journeys", "core_features_as_user_stories",
+        "api_surface_and_crucial_endpoints"]},
+    "data_model": {"ask": [
+        "core_entities", "entity_relationships",
+        "data_shape_structured_vs_unstructured", "read_write_access_patterns"]},
+    "nfr_and_scale": {"ask": [
+        "scale_estimate_dau_rps_launch_and_1y", "latency_targets",
+        "availability_target_nines", "consistency_strong_vs_eventual"]},
+    "architecture_and_components": {"ask": [
+        "client_facing_interface", "core_business_logic", "primary_data_store",
+        "supporting_services_lb_cache_queue_auth_workers"]},
+    "deep_dive_and_tradeoffs": {"ask": [
+        "sql_vs_nosql_for_chosen_store", "sync_apis_vs_event_driven_comms"]},
+})
+
+PHASE_SCHEMA_META_PROMPT: Final[str] = (
+    "Guide the user through the topics in this JSON agenda, Socratically, a few "
+    "open-ended questions at a time, digging deeper based on their answers:\n"
+)
+
+# Set COMPACT_PHASE_PROMPTS=0 to send the original verbose prose prompts.
+USE_COMPACT_PHASE_PROMPTS = os.getenv("COMPACT_PHASE_PROMPTS", "1") != "0"
+
+
+def _build_compact_phase_prompts() -> MappingProxyType:
+    return MappingProxyType({
+        phase: sys.intern(PHASE_SCHEMA_META_PROMPT + json.dumps(schema, separators=(",", ":")))
+        for phase, schema in PHASE_SCHEMAS.items()
+    })
+
+
+def _build_verbose_phase_prompts() -> MappingProxyType:
+    # Only materialized when the verbose fallback is actually selected
+    bodies = _verbose_prompts()
+    return MappingProxyType({
+        "vision_and_scoping": sys.intern(_pack(bodies["VISION_AND_SCOPING_PROMPT"])),
+        "functional_requirements": sys.intern(_pack(bodies["FUNCTIONAL_REQUIREMENTS_PROMPT"])),
+        "data_model": sys.intern(_pack(bodies["DATA_MODEL_PROMPT"])),
+        "nfr_and_scale": sys.intern(_pack(bodies["NFR_AND_SCALE_PROMPT"])),
+        "architecture_and_components": sys.intern(_pack(bodies["ARCHITECTURE_AND_COMPONENTS_PROMPT"])),
+        "deep_dive_and_tradeoffs": sys.intern(_pack(bodies["DEEP_DIVE_AND_TRADEOFFS_PROMPT"])),
+    })
+
+
+if USE_COMPACT_PHASE_PROMPTS:
+    PHASE_PROMPTS = _build_compact_phase_prompts()
+else:
+    PHASE_PROMPTS = _build_verbose_phase_prompts()
+
+# Split once at import so rendering is a plain concatenation instead of a
+# str.format pass over the whole template on every call.
+_SUMMARY_PREFIX, _SUMMARY_SUFFIX = SUMMARY_PROMPT.split("{design_document}", 1)
+
+
+# Every static prompt that contributes to a request, by name, for token
+# accounting. Tokenization happens provider-side here (no local tokenizer), so
+# we cache counts rather than token-id arrays.
+_ALL_PROMPTS = MappingProxyType({
+    "system": SYSTEM_PERSONA,
+    "router": ROUTER_PROMPT_STATIC,
+    "summary": SUMMARY_PROMPT,
+    **PHASE_PROMPTS,
+})
+
+
+@functools.lru_cache(maxsize=4)
+def get_prompt_token_lens(count_tokens: Callable[[str], int]) -> Dict[str, int]:
+    """
+    Counts the tokens of each static prompt exactly once per counter.
+
+    Args:
+        count_tokens: A callable such as ChatGoogleGenerativeAI.get_num_tokens.
+
+    Returns:
+        Dict[str, int]: Prompt name -> token count.
+    """
+    return {name: count_tokens(text) for name, text in _ALL_PROMPTS.items()}
+
+
+def max_context_free(phase: str, context_budget: int,
+                     count_tokens: Callable[[str], int]) -> int:
+    """
+    How many tokens of a context budget remain for dynamic content (history,
+    user turn) once a phase's static prompts are accounted for.
+
+    Uses the cached per-prompt token counts, so callers sizing requests or
+    packing concurrent turns never re-tokenize prompt content.
+
+    Args:
+        phase: A key of PHASE_PROMPTS.
+        context_budget: The total input-token budget for the request.
+        count_tokens: A callable such as ChatGoogleGenerativeAI.get_num_tokens.
+
+    Returns:
+        int: Remaining tokens, floored at zero.
+    """
+    lens = get_prompt_token_lens(count_tokens)
+    return max(context_budget - lens["system"] - lens[phase], 0)
+
+
+def render_summary(design_document: str) -> str:
+    """Renders the summary prompt around the assembled design document.
+
+    The template was split around its placeholder once at import, so this is a
+    single join with no format-mini-language parsing per call."""
+    return "".join((_SUMMARY_PREFIX, design_document, _SUMMARY_SUFFIX))
+
+
+def render_router(current_phase: str, user_command: str) -> str:
+    """Renders the dynamic router suffix (pair with ROUTER_PROMPT_STATIC)."""
+    return ROUTER_PROMPT_DYNAMIC.format(current_phase=current_phase, user_command=user_command)
+
+
+# One attribute-access handle over everything hot paths need; callers can bind
+# it to a local (e.g. P = PROMPTS) so lookups skip the module dict.
+PROMPTS = SimpleNamespace(
+    system=SYSTEM_PERSONA,
+    router_static=ROUTER_PROMPT_STATIC,
+    router_dynamic=ROUTER_PROMPT_DYNAMIC,
+    summary=SUMMARY_PROMPT,
+    history_summary=HISTORY_SUMMARY_PROMPT,
+    follow_up=PHASE_FOLLOW_UP_INSTRUCTION,
+    phases=PHASE_PROMPTS,
 )
\ No newline at end of file